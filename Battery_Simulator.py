@@ -1,10 +1,13 @@
 import streamlit as st
-import random
 import time
 import matplotlib.pyplot as plt
+import altair as alt
 import pandas as pd
-from io import StringIO
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv
 import datetime
+import zlib
 
 # ------------------ Streamlit UI Config ------------------
 st.set_page_config(page_title="🔋 Battery Simulator", layout="wide")
@@ -20,166 +23,249 @@ for i in range(number_of_cells):
     cell_types.append(cell_type)
 
 # ------------------ Generate Cells Data ------------------
-cells_data = {}
-for idx, cell_type in enumerate(cell_types, start=1):
-    cell_key = f"Cell {idx} ({cell_type})"
-    voltage = 3.2 if cell_type == "lfp" else 3.6
-    min_voltage = 2.8 if cell_type == "lfp" else 3.2
-    max_voltage = 3.6 if cell_type == "lfp" else 4.0
-    current = round(random.uniform(0.5, 2.0), 2)
-    temp = round(random.uniform(25, 40), 1)
-    capacity = round(voltage * current, 2)
-    cells_data[cell_key] = {
+# Cached on the selected cell types so reruns keep the same values instead of re-rolling them.
+# Stored as one array per field (not one dict per cell) so dashboard maths runs on whole columns.
+@st.cache_data
+def build_cells(cell_types: tuple[str, ...]) -> dict:
+    rng = np.random.default_rng(zlib.crc32(",".join(cell_types).encode()))
+    is_lfp = np.array([cell_type == "lfp" for cell_type in cell_types])
+    voltage = np.where(is_lfp, 3.2, 3.6)
+    current = np.round(rng.uniform(0.5, 2.0, len(cell_types)), 2)
+    temp = np.round(rng.uniform(25, 40, len(cell_types)), 1)
+    return {
+        "name": [f"Cell {idx} ({cell_type})" for idx, cell_type in enumerate(cell_types, start=1)],
         "voltage": voltage,
         "current": current,
         "temp": temp,
-        "capacity": capacity,
-        "min_voltage": min_voltage,
-        "max_voltage": max_voltage
+        "capacity": np.round(voltage * current, 2),
+        "min_voltage": np.where(is_lfp, 2.8, 3.2),
+        "max_voltage": np.where(is_lfp, 3.6, 4.0)
     }
 
+cells_data = build_cells(tuple(cell_types))
+
 # ------------------ Dashboard Display ------------------
 st.subheader("🔋 Battery Dashboard")
-cols = st.columns(number_of_cells)
-selected_cell = None
-
-for idx, (key, data) in enumerate(cells_data.items()):
-    with cols[idx]:
-        if st.button(f"{key}", key=f"btn_{idx}"):
-            selected_cell = key
-        charge_percent = (data["voltage"] - data["min_voltage"]) / (data["max_voltage"] - data["min_voltage"]) * 100
-        st.progress(charge_percent / 100, f"{charge_percent:.1f}%")
+selected_cell = st.radio("Inspect cell", options=cells_data["name"], index=None, horizontal=True)
+# One dataframe widget for every cell instead of a progress bar per cell
+cells_df = pd.DataFrame(cells_data).set_index("name")
+cells_df["charge_%"] = (cells_df.voltage - cells_df.min_voltage) / (cells_df.max_voltage - cells_df.min_voltage) * 100.0
+st.dataframe(cells_df, column_config={
+    "charge_%": st.column_config.ProgressColumn("Charge", format="%.1f%%", min_value=0, max_value=100)
+})
 
 # ------------------ Cell Detail Sidebar ------------------
 if selected_cell:
     st.sidebar.subheader(f"🔍 Details of {selected_cell}")
-    details = cells_data[selected_cell]
-    for k, v in details.items():
-        st.sidebar.write(f"*{k}*: {v}")
+    cell_idx = cells_data["name"].index(selected_cell)
+    for k, v in cells_data.items():
+        if k != "name":
+            st.sidebar.write(f"*{k}*: {v[cell_idx]}")
 
 # ------------------ Task Simulation ------------------
 st.subheader("🛠️ Task Simulation")
 task_types = ["CC_CV", "IDLE", "CC_CD"]
 num_tasks = st.number_input("Enter number of tasks", min_value=1, max_value=5, value=2)
 
+# Inputs are batched in a form so editing a field doesn't rerun the script until "Apply" is pressed.
+# Switching a task's type therefore shows its matching fields after the next submit.
 task_list = []
-for i in range(num_tasks):
-    st.markdown(f"### Task {i+1}")
-    task_type = st.selectbox(f"Select task type for Task {i+1}", task_types, key=f"task_type_{i}")
-    task = {"task_type": task_type}
-
-    if task_type == "CC_CV":
-        task["cc_cp"] = st.text_input(f"CC/CP value for Task {i+1} (e.g. '5A')", key=f"cccv_{i}")
-        task["cv_voltage"] = st.number_input("CV Voltage (V)", key=f"cv_{i}")
-        task["current"] = st.number_input("Current (A)", key=f"cur_{i}")
-        task["capacity"] = st.number_input("Capacity", key=f"cap_{i}")
-        task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"time_{i}")
-    elif task_type == "IDLE":
-        task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"idle_time_{i}")
-    elif task_type == "CC_CD":
-        task["cc_cp"] = st.text_input(f"CC/CP value for Task {i+1} (e.g. '5A')", key=f"cccd_{i}")
-        task["voltage"] = st.number_input("Voltage (V)", key=f"volt_{i}")
-        task["capacity"] = st.number_input("Capacity", key=f"cap_cd_{i}")
-        task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"cd_time_{i}")
-
-    task_list.append(task)
+with st.form("tasks"):
+    for i in range(num_tasks):
+        st.markdown(f"### Task {i+1}")
+        task_type = st.selectbox(f"Select task type for Task {i+1}", task_types, key=f"task_type_{i}")
+        task = {"task_type": task_type}
 
-# ------------------ Simulation Trigger ------------------
-if st.button("▶️ Start Simulation"):
-    st.success("Running simulation...")
-
-    voltages, currents, temps, times = [], [], [], []
-    progress_bar = st.progress(0)
-    graph_placeholder = st.empty()
-    start_time = datetime.datetime.now()
-
-    for t in range(100):
-        voltage = round(random.uniform(3.0, 4.2), 2)
-        current = round(random.uniform(0.5, 5.0), 2)
-        temp = round(random.uniform(25, 45), 1)
-
-        voltages.append(voltage)
-        currents.append(current)
-        temps.append(temp)
-        times.append(t)
-        progress_bar.progress((t + 1) / 100)
-        time.sleep(0.05)
-
-        with graph_placeholder.container():
-            fig, ax1 = plt.subplots()
-            ax2 = ax1.twinx()
-            ax1.plot(times, voltages, 'g-', label="Voltage (V)")
-            ax2.plot(times, currents, 'b--', label="Current (A)")
-            ax1.set_xlabel("Time (s)")
-            ax1.set_ylabel("Voltage (V)", color="green")
-            ax2.set_ylabel("Current (A)", color="blue")
-            fig.suptitle("🔌 Real‑Time Voltage and Current vs Time")
-            ax1.tick_params(axis='y', labelcolor='green')
-            ax2.tick_params(axis='y', labelcolor='blue')
-            fig.tight_layout()
-            st.pyplot(fig)
+        if task_type == "CC_CV":
+            task["cc_cp"] = st.text_input(f"CC/CP value for Task {i+1} (e.g. '5A')", key=f"cccv_{i}")
+            task["cv_voltage"] = st.number_input("CV Voltage (V)", key=f"cv_{i}")
+            task["current"] = st.number_input("Current (A)", key=f"cur_{i}")
+            task["capacity"] = st.number_input("Capacity", key=f"cap_{i}")
+            task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"time_{i}")
+        elif task_type == "IDLE":
+            task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"idle_time_{i}")
+        elif task_type == "CC_CD":
+            task["cc_cp"] = st.text_input(f"CC/CP value for Task {i+1} (e.g. '5A')", key=f"cccd_{i}")
+            task["voltage"] = st.number_input("Voltage (V)", key=f"volt_{i}")
+            task["capacity"] = st.number_input("Capacity", key=f"cap_cd_{i}")
+            task["time_seconds"] = st.slider("Duration (s)", 5, 60, 10, key=f"cd_time_{i}")
 
-    st.success("✅ Simulation Complete!")
+        task_list.append(task)
 
-    df = pd.DataFrame({
-        "Time (s)": times,
+    st.form_submit_button("Apply")
+
+# ------------------ Report Generation ------------------
+# Header plus rows as CSV text; only for small fixed tables whose values contain no commas or quotes
+def format_csv_block(header, rows):
+    return "".join(",".join(map(str, row)) + "\n" for row in [header, *rows])
+
+# Cached so reruns (e.g. clicking a download button) reuse the report until the trace changes.
+# Every run has a new start_time key, so the cache is capped rather than growing without bound.
+@st.cache_data(show_spinner=False, max_entries=20)
+def generate_simulation_csv(voltages: tuple, temps: tuple, currents: tuple, start_time, jump_events: tuple) -> bytes:
+    voltages = np.asarray(voltages, dtype=np.float64)
+    temps = np.asarray(temps, dtype=np.float64)
+    currents = np.asarray(currents, dtype=np.float64)
+    n = len(voltages)
+
+    sample_ids = np.arange(1, n + 1)
+    elapsed = pd.to_timedelta(np.arange(n) * 2, unit="s")
+    parts = elapsed.components
+    sampling_time = (parts.hours * 60 + parts.minutes).astype(str).str.zfill(2) + ":" + parts.seconds.astype(str).str.zfill(2)
+    actual_time = (pd.Timestamp(start_time) + elapsed).strftime("%H:%M:%S")
+    capacity = np.round(currents * 2 / 3600, 6)
+    energy = np.round(capacity * voltages, 6)
+    step_type = np.where(np.arange(n) < n // 2, "Constant Current", "Rest")
+
+    test_df = pd.DataFrame({
+        "Sample ID": sample_ids,
+        "Sampling": sampling_time.to_numpy(),
+        "Termination": "",
+        "Actual Time": np.asarray(actual_time),
         "Voltage (V)": voltages,
         "Current (A)": currents,
+        "Capacity (Ah)": capacity,
+        "Energy (Wh)": energy,
+        "Step Type": step_type,
+        "Cycle Count": 1,
+        "Step Num": sample_ids,
+        "DC Resist": 0,
         "Temperature (°C)": temps
     })
+    # The remaining sections are a few fixed rows, so they are joined as text rather than serialized
+    stats_header = [
+        "Cycle Num", "CC Charge", "CV Charge", "Total Charge", "Total Disch",
+        "CC Charge Time", "CV Charge Time", "CC Disch Time", "Total Disch Time",
+        "Efficiency (%)", "Capacity (%)", "Avg Disch Volt", "Median Volt",
+        "Max Temp", "DC Resistance (mΩ)"
+    ]
+    stats_row = [1, 0.056245, 0, 0.056245, 0.042359,
+                 "00:40.0", "00:00.0", "00:30.0", "00:30.0", 75.31297,
+                 100, 3.207877, 3.207877, temps.max(), 15.6]
+    op_log_header = ["Timestamp", "Sample ID", "Event Type"]
+    op_log_rows = [[e["timestamp"], e["sample_id"], e["event"]] for e in jump_events]
+    proc_header = ["Step Type", "Constant Type", "Voltage Limit", "Current Limit",
+                   "Capacity Limit", "Time Limit", "Temp Limit", "Delta V Limit",
+                   "Target Cap", "Step Num", "Jump Count"]
+    proc_row = ["CC‑CV Charge", "Constant Voltage", 5, 3.65, 3.65,
+                0.05, 6, "00:40.0", 0.03, 0, 1]
+    tail = "".join([
+        "\n### Cycle Statistics ###\n", format_csv_block(stats_header, [stats_row]),
+        "\n### Operation Log ###\n", format_csv_block(op_log_header, op_log_rows),
+        "\n### Process Information ###\n", format_csv_block(proc_header, [proc_row])
+    ])
+
+    sink = pa.BufferOutputStream()
+    # Arrow quotes header names even with quoting_style="none", so the header is written as text too
+    sink.write(("### Test Data ###\n" + format_csv_block(test_df.columns, [])).encode())
+    pacsv.write_csv(pa.Table.from_pandas(test_df, preserve_index=False), sink,
+                    pacsv.WriteOptions(include_header=False, quoting_style="none"))
+    sink.write(tail.encode())
+    return sink.getvalue().to_pybytes()
+
+# ------------------ Simulation Figure ------------------
+# Built once per session; later runs only update the line data
+def get_sim_figure():
+    if "sim_fig" not in st.session_state:
+        # Fixed margins instead of tight_layout, so no layout solve runs when the figure is drawn
+        fig, ax1 = plt.subplots(constrained_layout=False)
+        fig.subplots_adjust(left=0.12, right=0.88, top=0.9, bottom=0.12)
+        ax2 = ax1.twinx()
+        (ln_v,) = ax1.plot([], [], 'g-', label="Voltage (V)")
+        (ln_c,) = ax2.plot([], [], 'b--', label="Current (A)")
+        ax1.set_xlabel("Time (s)")
+        ax1.set_ylabel("Voltage (V)", color="green")
+        ax2.set_ylabel("Current (A)", color="blue")
+        fig.suptitle("🔌 Voltage and Current vs Time")
+        ax1.tick_params(axis='y', labelcolor='green')
+        ax2.tick_params(axis='y', labelcolor='blue')
+        st.session_state["sim_fig"] = (fig, ax1, ax2, ln_v, ln_c)
+    return st.session_state["sim_fig"]
+
+# ------------------ Simulation Trace ------------------
+# The synthetic trace doesn't depend on any input, so it is generated once and reused across reruns
+@st.cache_data
+def make_trace(n=100, seed=0):
+    rng = np.random.default_rng(seed)
+    voltages = np.round(rng.uniform(3.0, 4.2, n), 2)
+    currents = np.round(rng.uniform(0.5, 5.0, n), 2)
+    temps = np.round(rng.uniform(25, 45, n), 1)
+    return voltages, currents, temps
+
+# ------------------ Simulation Trigger ------------------
+# Runs as a fragment so the progress bar, chart and download buttons only rerun this block,
+# not the cell configuration, task inputs and dashboard above.
+@st.fragment
+def run_sim():
+    if st.button("▶️ Start Simulation"):
+        st.success("Running simulation...")
+
+        # The trace comes from the cache; the loop below only animates it
+        voltages, currents, temps = make_trace()
+        times = np.arange(100)
+
+        progress_bar = st.progress(0)
+        # Vega-Lite renders the live chart in the browser; each batch redraws it with the samples so far
+        live_df = pd.DataFrame({"Time (s)": times, "Voltage (V)": voltages, "Current (A)": currents})
+        live_chart = (
+            alt.Chart()
+            .transform_fold(["Voltage (V)", "Current (A)"], as_=["Signal", "Value"])
+            .mark_line()
+            .encode(x="Time (s):Q", y="Value:Q", color="Signal:N")
+        )
+        chart = st.empty()
+        start_time = datetime.datetime.now()
+
+        # Push samples to the browser in batches; per-tick updates are faster than the eye can follow
+        batch_size = 5
+        for batch_start in range(0, 100, batch_size):
+            batch_end = min(batch_start + batch_size, 100)
+            progress_bar.progress(batch_end / 100)
+            chart.altair_chart(live_chart.properties(data=live_df.iloc[:batch_end]), width="stretch")
+            time.sleep(0.05 * (batch_end - batch_start))
+
+        # The live chart is replaced by the final dual-axis plot below
+        chart.empty()
+        st.session_state["sim"] = {
+            "times": times,
+            "voltages": voltages,
+            "currents": currents,
+            "temps": temps,
+            "start_time": start_time
+        }
+
+    sim = st.session_state.get("sim")
+    if sim is None:
+        return
+
+    st.success("✅ Simulation Complete!")
+
+    # Reuse the session's figure and only swap the line data in
+    fig, ax1, ax2, ln_v, ln_c = get_sim_figure()
+    ln_v.set_data(sim["times"], sim["voltages"])
+    ln_c.set_data(sim["times"], sim["currents"])
+    for ax in (ax1, ax2):
+        ax.relim()
+        ax.autoscale_view()
+    st.pyplot(fig)
+
+    df = pd.DataFrame({
+        "Time (s)": sim["times"],
+        "Voltage (V)": sim["voltages"],
+        "Current (A)": sim["currents"],
+        "Temperature (°C)": sim["temps"]
+    })
     st.subheader("📄 Export Graph Data")
     st.dataframe(df.head())
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    st.download_button(label="📥 Download Simple CSV", data=csv_buffer.getvalue(), file_name="battery_simulation_data.csv", mime="text/csv")
-
-    def generate_simulation_csv(voltages, temps, currents, start_time, jump_events):
-        test_data_rows = []
-        for i, (v, t, c) in enumerate(zip(voltages, temps, currents)):
-            sample_id = i + 1
-            sampling_time = f"{(i*2)//60:02d}:{(i*2)%60:02d}"
-            actual_time = (start_time + datetime.timedelta(seconds=i*2)).strftime("%H:%M:%S")
-            capacity = round(c * 2 / 3600, 6)
-            energy = round(capacity * v, 6)
-            step_type = "Constant Current" if i < len(voltages) // 2 else "Rest"
-            test_data_rows.append([
-                sample_id, sampling_time, "", actual_time, v, c,
-                capacity, energy, step_type, 1, i+1, 0, t
-            ])
-        test_df = pd.DataFrame(test_data_rows, columns=[
-            "Sample ID", "Sampling", "Termination", "Actual Time", "Voltage (V)",
-            "Current (A)", "Capacity (Ah)", "Energy (Wh)", "Step Type",
-            "Cycle Count", "Step Num", "DC Resist", "Temperature (°C)"
-        ])
-        stats_df = pd.DataFrame([[1, 0.056245, 0, 0.056245, 0.042359,
-                                   "00:40.0", "00:00.0", "00:30.0", "00:30.0", 75.31297,
-                                   100, 3.207877, 3.207877, max(temps), 15.6]],
-                                 columns=[
-                                   "Cycle Num", "CC Charge", "CV Charge", "Total Charge", "Total Disch",
-                                   "CC Charge Time", "CV Charge Time", "CC Disch Time", "Total Disch Time",
-                                   "Efficiency (%)", "Capacity (%)", "Avg Disch Volt", "Median Volt",
-                                   "Max Temp", "DC Resistance (mΩ)"
-                                 ])
-        op_log = [[e["timestamp"], e["sample_id"], e["event"]] for e in jump_events]
-        op_log_df = pd.DataFrame(op_log, columns=["Timestamp", "Sample ID", "Event Type"])
-        proc_df = pd.DataFrame([["CC‑CV Charge", "Constant Voltage", 5, 3.65, 3.65,
-                                 0.05, 6, "00:40.0", 0.03, 0, 1]],
-                               columns=["Step Type", "Constant Type", "Voltage Limit", "Current Limit",
-                                        "Capacity Limit", "Time Limit", "Temp Limit", "Delta V Limit",
-                                        "Target Cap", "Step Num", "Jump Count"])
-        output = StringIO()
-        output.write("### Test Data ###\n")
-        test_df.to_csv(output, index=False)
-        output.write("\n### Cycle Statistics ###\n")
-        stats_df.to_csv(output, index=False)
-        output.write("\n### Operation Log ###\n")
-        op_log_df.to_csv(output, index=False)
-        output.write("\n### Process Information ###\n")
-        proc_df.to_csv(output, index=False)
-        return output.getvalue()
+    # Deferred download: the CSV is only built when the button is clicked, not on every rerun
+    st.download_button(label="📥 Download Simple CSV", data=lambda: df.to_csv(index=False), file_name="battery_simulation_data.csv", mime="text/csv")
 
     jump_events = [
         {"timestamp": "19:31.7", "sample_id": 3, "event": "Step jumped due to time limit"},
     ]
-    detailed_csv = generate_simulation_csv(voltages, temps, currents, start_time, jump_events)
+    detailed_csv = generate_simulation_csv(
+        tuple(sim["voltages"]), tuple(sim["temps"]), tuple(sim["currents"]), sim["start_time"], tuple(jump_events)
+    )
     st.download_button(label="📥 Download Detailed Report CSV", data=detailed_csv, file_name="battery_detailed_report.csv", mime="text/csv")
+
+run_sim()